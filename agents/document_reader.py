@@ -1,30 +1,78 @@
+import asyncio
 import os
+import re
+import threading
 
-def read_patient_documents(patient_id: str) -> dict:
+PATIENT_DIR = "data/patients"
+
+# Directory listing cache: base_path → (mtime_ns, {patient_id: [DirEntry]})
+# Rebuilt only when a file is added or removed in base_path.
+_DIR_CACHE: dict[str, tuple[int, dict[str, list[os.DirEntry]]]] = {}
+_DIR_LOCK = threading.Lock()
+_PATIENT_PREFIX = re.compile(r"^(patient_\d+)_")
+
+
+def list_patient_documents(patient_id: str, base_path: str = PATIENT_DIR) -> list:
     """
-    Read all documents for a patient.
+    Return the directory entries belonging to a patient.
+    Uses a cached per-patient index of base_path.
+    """
+    mtime = os.stat(base_path).st_mtime_ns
+
+    with _DIR_LOCK:
+        cached = _DIR_CACHE.get(base_path)
+        if cached is None or cached[0] != mtime:
+            index = {}
+            with os.scandir(base_path) as it:
+                for entry in it:
+                    match = _PATIENT_PREFIX.match(entry.name)
+                    if match:
+                        index.setdefault(match.group(1), []).append(entry)
+            cached = (mtime, index)
+            _DIR_CACHE[base_path] = cached
+
+    return cached[1].get(patient_id, [])
+
+
+def _read_file(path: str) -> str:
+    with open(path, "r") as f:
+        return f.read()
+
+
+async def read_patient_documents_async(patient_id: str, verbose: bool = True) -> dict:
+    """
+    Read all documents for a patient concurrently.
     Returns dictionary of document_type → content.
     """
-    base_path = "data/patients"
-    documents = {}
+    entries = list_patient_documents(patient_id)
+
+    async def _read(entry):
+        return entry.name, await asyncio.to_thread(_read_file, entry.path)
 
-    for filename in os.listdir(base_path):
-        if patient_id in filename:
-            filepath = os.path.join(base_path, filename)
-            with open(filepath, "r") as f:
-                content = f.read()
+    results = await asyncio.gather(*[_read(e) for e in entries])
 
-            doc_type = filename.replace(f"{patient_id}_", "").replace(".txt", "")
-            documents[doc_type] = content
-            # Using plain ASCII symbols to avoid Windows console encoding issues
+    documents = {}
+    for filename, content in results:
+        doc_type = filename.replace(f"{patient_id}_", "").replace(".txt", "")
+        documents[doc_type] = content
+        # Using plain ASCII symbols to avoid Windows console encoding issues
+        if verbose:
             print(f"[OK] Loaded: {filename}")
 
     return documents
 
 
+def read_patient_documents(patient_id: str) -> dict:
+    """
+    Read all documents for a patient.
+    Returns dictionary of document_type → content.
+    """
+    return asyncio.run(read_patient_documents_async(patient_id))
+
+
 # Test it
 if __name__ == "__main__":
     docs = read_patient_documents("patient_001")
     print(f"\nLoaded {len(docs)} documents:")
     for doc_type, content in docs.items():
-        print(f"  - {doc_type}: {len(content)} characters")
\ No newline at end of file
+        print(f"  - {doc_type}: {len(content)} characters")
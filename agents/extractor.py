@@ -1,6 +1,8 @@
+import hashlib
 import json
 import os
 import sys
+import time
 
 PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 if PROJECT_ROOT not in sys.path:
@@ -9,11 +11,85 @@ if PROJECT_ROOT not in sys.path:
 from dotenv import load_dotenv
 load_dotenv()
 
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
 USE_MOCK = os.getenv("USE_MOCK_GEMINI", "0") == "1"
 
+# Extraction cache — same prompt means same documents, so reuse the answer
+CACHE_DIR = "data/extraction_cache"
+CACHE_TTL = int(os.getenv("EXTRACTION_CACHE_TTL", "86400"))  # 0 disables
+
 if not USE_MOCK:
-    from google import genai
-    client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+    from agents.gemini_client import get_client
+
+
+# Extraction prompt — only the documents change per call
+PROMPT_TEMPLATE = """You are a clinical data abstractor.
+Read these patient documents and extract information
+to fill the REDCap form fields.
+
+PATIENT DOCUMENTS:
+{combined_docs}
+
+Return ONLY raw JSON. No markdown. No code fences.
+Start directly with {{
+
+{{
+  "timeline": {{
+    "date_of_diagnosis": "date pathology confirmed cancer or null",
+    "date_of_last_visit": "most recent visit date or null",
+    "date_of_last_scan": "most recent imaging date or null",
+    "date_of_death": "date of death or null"
+  }},
+  "staging": {{
+    "primary_cancer": "cancer type or null",
+    "laterality": "left/right/bilateral or null",
+    "t_stage": "T stage or null",
+    "n_stage": "N stage or null",
+    "m_stage": "M stage or null",
+    "overall_stage": "stage group or null",
+    "metastasis": "yes/no or null"
+  }},
+  "pathology": {{
+    "specimen_site": "biopsy site or null",
+    "quadrant": "breast quadrant or null",
+    "er_status": "ER positive/negative or null",
+    "pr_status": "PR positive/negative or null",
+    "her2_status": "HER2 positive/negative or null",
+    "ki67_percentage": "Ki67 percentage or null",
+    "grade": "tumor grade or null",
+    "diagnosis": "full pathology diagnosis or null"
+  }},
+  "comorbidities": {{
+    "hypertension": "yes/no ONLY if MD note first 3-6 months or null",
+    "diabetes": "yes/no ONLY if MD note first 3-6 months or null",
+    "hypothyroidism": "yes/no ONLY if MD note first 3-6 months or null",
+    "other": "other comorbidities from first 3-6 months MD note or null"
+  }},
+  "germline": {{
+    "brca1_status": "pathogenic/negative or null",
+    "brca2_status": "pathogenic/negative or null",
+    "variant_found": "variant name or null",
+    "classification": "classification or null"
+  }},
+  "medications": {{
+    "line_of_treatment": "1st line/2nd line or null",
+    "intent": "neoadjuvant/adjuvant/palliative or null",
+    "regimen": "regimen name or null",
+    "drugs": "list of drugs or null"
+  }}
+}}
+
+CRITICAL RULES:
+1. Comorbidities ONLY from MD notes in first 3-6 months
+2. Medications ONLY from MD notes
+3. Date of diagnosis = pathology confirmation date only
+4. If not found use null
+5. Never guess"""
 
 
 def mock_extraction(patient_id: str) -> dict:
@@ -70,92 +146,118 @@ def mock_extraction(patient_id: str) -> dict:
     }
 
 
+def build_prompt(documents: dict) -> str:
+    combined_docs = "".join(
+        f"\n\n--- {doc_type.upper()} ---\n{content}"
+        for doc_type, content in documents.items()
+    )
+
+    return PROMPT_TEMPLATE.format(combined_docs=combined_docs)
+
+
+def parse_response(text: str, patient_id: str, verbose: bool = True) -> dict:
+    raw = text.strip().removeprefix("```json").removeprefix("```").removesuffix("```").strip()
+
+    if verbose:
+        print("Gemini responded. Parsing...")
+    extracted = _json_loads(raw)
+    extracted["patient_id"] = patient_id
+
+    return extracted
+
+
+def _cache_path(prompt: str) -> str:
+    key = hashlib.sha256(prompt.encode()).hexdigest()
+    return os.path.join(CACHE_DIR, f"{key}.json")
+
+
+def load_cached_extraction(prompt: str, patient_id: str, verbose: bool = True) -> dict | None:
+    """
+    Return a previous extraction for this exact prompt,
+    or None if there is no fresh cache entry.
+    """
+    if CACHE_TTL <= 0:
+        return None
+
+    path = _cache_path(prompt)
+    try:
+        if time.time() - os.path.getmtime(path) > CACHE_TTL:
+            return None
+        with open(path, "r") as f:
+            extracted = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if verbose:
+        print("Cache hit — skipping API call")
+    extracted["patient_id"] = patient_id
+    return extracted
+
+
+def save_cached_extraction(prompt: str, extracted: dict):
+    if CACHE_TTL <= 0:
+        return
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = _cache_path(prompt)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+
+    with open(tmp_path, "w") as f:
+        json.dump(extracted, f)
+    os.replace(tmp_path, path)
+
+
 def extract_clinical_data(documents: dict, patient_id: str) -> dict:
 
     if USE_MOCK:
         print("MOCK MODE — skipping API call")
         return mock_extraction(patient_id)
 
-    combined_docs = ""
-    for doc_type, content in documents.items():
-        combined_docs += f"\n\n--- {doc_type.upper()} ---\n{content}"
+    prompt = build_prompt(documents)
 
-    prompt = f"""You are a clinical data abstractor.
-Read these patient documents and extract information
-to fill the REDCap form fields.
+    cached = load_cached_extraction(prompt, patient_id)
+    if cached is not None:
+        return cached
 
-PATIENT DOCUMENTS:
-{combined_docs}
+    print("Sending documents to Gemini for extraction...")
 
-Return ONLY raw JSON. No markdown. No code fences.
-Start directly with {{
+    response = get_client().models.generate_content(
+        model="gemini-2.0-flash",
+        contents=prompt
+    )
 
-{{
-  "timeline": {{
-    "date_of_diagnosis": "date pathology confirmed cancer or null",
-    "date_of_last_visit": "most recent visit date or null",
-    "date_of_last_scan": "most recent imaging date or null",
-    "date_of_death": "date of death or null"
-  }},
-  "staging": {{
-    "primary_cancer": "cancer type or null",
-    "laterality": "left/right/bilateral or null",
-    "t_stage": "T stage or null",
-    "n_stage": "N stage or null",
-    "m_stage": "M stage or null",
-    "overall_stage": "stage group or null",
-    "metastasis": "yes/no or null"
-  }},
-  "pathology": {{
-    "specimen_site": "biopsy site or null",
-    "quadrant": "breast quadrant or null",
-    "er_status": "ER positive/negative or null",
-    "pr_status": "PR positive/negative or null",
-    "her2_status": "HER2 positive/negative or null",
-    "ki67_percentage": "Ki67 percentage or null",
-    "grade": "tumor grade or null",
-    "diagnosis": "full pathology diagnosis or null"
-  }},
-  "comorbidities": {{
-    "hypertension": "yes/no ONLY if MD note first 3-6 months or null",
-    "diabetes": "yes/no ONLY if MD note first 3-6 months or null",
-    "hypothyroidism": "yes/no ONLY if MD note first 3-6 months or null",
-    "other": "other comorbidities from first 3-6 months MD note or null"
-  }},
-  "germline": {{
-    "brca1_status": "pathogenic/negative or null",
-    "brca2_status": "pathogenic/negative or null",
-    "variant_found": "variant name or null",
-    "classification": "classification or null"
-  }},
-  "medications": {{
-    "line_of_treatment": "1st line/2nd line or null",
-    "intent": "neoadjuvant/adjuvant/palliative or null",
-    "regimen": "regimen name or null",
-    "drugs": "list of drugs or null"
-  }}
-}}
+    extracted = parse_response(response.text, patient_id)
+    save_cached_extraction(prompt, extracted)
 
-CRITICAL RULES:
-1. Comorbidities ONLY from MD notes in first 3-6 months
-2. Medications ONLY from MD notes
-3. Date of diagnosis = pathology confirmation date only
-4. If not found use null
-5. Never guess"""
+    return extracted
 
-    print("Sending documents to Gemini for extraction...")
 
-    response = client.models.generate_content(
+async def extract_clinical_data_async(documents: dict, patient_id: str, verbose: bool = True) -> dict:
+    """
+    Same as extract_clinical_data but awaits Gemini
+    through the async client, so the event loop stays free.
+    """
+    if USE_MOCK:
+        if verbose:
+            print("MOCK MODE — skipping API call")
+        return mock_extraction(patient_id)
+
+    prompt = build_prompt(documents)
+
+    cached = load_cached_extraction(prompt, patient_id, verbose)
+    if cached is not None:
+        return cached
+
+    if verbose:
+        print("Sending documents to Gemini for extraction...")
+
+    response = await get_client().aio.models.generate_content(
         model="gemini-2.0-flash",
         contents=prompt
     )
 
-    raw = response.text.strip()
-    raw = raw.replace("```json", "").replace("```", "").strip()
-
-    print("Gemini responded. Parsing...")
-    extracted = json.loads(raw)
-    extracted["patient_id"] = patient_id
+    extracted = parse_response(response.text, patient_id, verbose)
+    save_cached_extraction(prompt, extracted)
 
     return extracted
 
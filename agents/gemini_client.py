@@ -0,0 +1,24 @@
+import os
+import threading
+
+from google import genai
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> genai.Client:
+    """
+    Shared Gemini client for the whole process.
+    Built on first use, then reused by every request.
+    Sync calls use client.models, async calls use client.aio.models.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = genai.Client(
+                    api_key=os.getenv("GEMINI_API_KEY"),
+                    http_options={"timeout": 60_000}  # milliseconds
+                )
+    return _client
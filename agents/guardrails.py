@@ -1,4 +1,7 @@
+import dataclasses
+import functools
 import os
+import re
 import sys
 from datetime import datetime
 
@@ -6,6 +9,21 @@ PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 if PROJECT_ROOT not in sys.path:
     sys.path.append(PROJECT_ROOT)
 
+from pydantic import TypeAdapter, ValidationError
+
+from models.audit_record import FieldResult
+from models.redcap_form import REDCapForm, build_form_fast
+
+# REDCap forms are plain dataclasses; Pydantic validates them via an adapter
+REDCAP_FORM_ADAPTER = TypeAdapter(REDCapForm)
+
+# REDCap field names per section, e.g. "germline" → ("brca1_status", ...)
+SECTION_FIELDS = {
+    f.name: tuple(f.type.__dataclass_fields__)
+    for f in dataclasses.fields(REDCapForm)
+    if dataclasses.is_dataclass(f.type)
+}
+
 
 # Confidence thresholds
 THRESHOLDS = {
@@ -18,23 +36,41 @@ THRESHOLDS = {
 }
 
 # Fields that always need human review
-ALWAYS_REVIEW = [
+ALWAYS_REVIEW = frozenset({
     "staging.overall_stage",
     "staging.metastasis",
     "pathology.diagnosis",
     "germline.brca1_status",
     "germline.variant_found"
-]
+})
 
 # Fields where empty is safer than wrong
-EMPTY_BEATS_WRONG = [
+EMPTY_BEATS_WRONG = frozenset({
     "staging.t_stage",
     "staging.n_stage",
     "staging.m_stage",
     "pathology.er_status",
     "pathology.her2_status",
     "medications.drugs"
-]
+})
+
+# Source matchers — compiled once, case-insensitive
+VALID_COMORBIDITY_SOURCE = re.compile(r"visit ?1", re.IGNORECASE)
+FORBIDDEN_MEDICATION_SOURCE = re.compile(
+    r"pharmacy|nursing|dispensing|prescription", re.IGNORECASE
+)
+
+
+# Source strings repeat across fields and patients (one per section),
+# so each distinct source is matched once and the verdict reused.
+@functools.lru_cache(maxsize=1024)
+def is_valid_comorbidity_source(source_document: str) -> bool:
+    return VALID_COMORBIDITY_SOURCE.search(source_document) is not None
+
+
+@functools.lru_cache(maxsize=1024)
+def is_forbidden_medication_source(source_document: str) -> bool:
+    return FORBIDDEN_MEDICATION_SOURCE.search(source_document) is not None
 
 
 def check_comorbidity_source_rule(
@@ -51,10 +87,7 @@ def check_comorbidity_source_rule(
         return True, "Field is null — acceptable"
 
     # Check source is MD note visit 1
-    valid_sources = ["md_note_visit1", "visit1", "visit 1"]
-    source_lower = source_document.lower()
-
-    if any(s in source_lower for s in valid_sources):
+    if is_valid_comorbidity_source(source_document):
         return True, "Source is MD note visit 1 — within 3-6 month window"
     else:
         return False, f"REJECTED — comorbidity source '{source_document}' is outside 3-6 month window. Rule 001 violation."
@@ -73,10 +106,7 @@ def check_medication_source_rule(
     if value is None:
         return True, "Field is null — acceptable"
 
-    forbidden_sources = ["pharmacy", "nursing", "dispensing", "prescription"]
-    source_lower = source_document.lower()
-
-    if any(s in source_lower for s in forbidden_sources):
+    if is_forbidden_medication_source(source_document):
         return False, f"REJECTED — medication source '{source_document}' is not an MD note. Rule 006 violation."
 
     return True, "Source is MD note — valid for medication abstraction"
@@ -121,7 +151,77 @@ def check_staging_confirmation_rule(
     return True, "Staging confirmed by both imaging and MD note"
 
 
-def apply_guardrails(extracted: dict, audit_fields: list) -> dict:
+# Rule dispatch — built once at import.
+# Every check takes (form, field_key, value, source).
+# Field rules always run; section rules only run on non-null values.
+FIELD_DISPATCH = {
+    # GUARDRAIL 3 — Diagnosis date rule
+    "timeline.date_of_diagnosis": lambda form, field, value, source: check_diagnosis_date_rule(value),
+    # GUARDRAIL 4 — Staging confirmation
+    "staging.overall_stage": lambda form, field, value, source: check_staging_confirmation_rule(
+        form.staging.t_stage,
+        form.staging.n_stage,
+        form.staging.m_stage
+    )
+}
+
+SECTION_DISPATCH = {
+    # GUARDRAIL 1 — Comorbidity source rule
+    "comorbidities": lambda form, field, value, source: check_comorbidity_source_rule(field, value, source),
+    # GUARDRAIL 2 — Medication source rule
+    "medications": lambda form, field, value, source: check_medication_source_rule(field, value, source)
+}
+
+
+def validate_extraction(extracted: dict) -> tuple:
+    """
+    Validate an extraction against the REDCap schema.
+    Returns (form, schema_errors, invalid) where invalid maps each
+    failing "section.field" (or whole section) to its error message.
+    Invalid parts are left out of the form so the rest can be checked.
+    """
+    try:
+        return REDCAP_FORM_ADAPTER.validate_python(extracted), [], {}
+    except ValidationError as e:
+        errors = e.errors()
+
+    # Union types report one error per alternative and deeper locations
+    # inside lists; report each section.field once
+    schema_errors = {}
+    invalid = {}
+    cleaned = {
+        section: dict(values) if isinstance(values, dict) else values
+        for section, values in extracted.items()
+    }
+    for err in errors:
+        loc = [str(part) for part in err["loc"][:2]]
+        schema_errors.setdefault(".".join(loc), err["msg"])
+
+        if loc[0] == "patient_id":
+            continue
+        if len(loc) == 1:
+            invalid.setdefault(loc[0], err["msg"])
+            cleaned.pop(loc[0], None)
+        else:
+            invalid.setdefault(f"{loc[0]}.{loc[1]}", err["msg"])
+            cleaned[loc[0]].pop(loc[1], None)
+
+    # Everything left passed validation, so build the form without re-checking it
+    form = build_form_fast(str(extracted.get("patient_id") or ""), cleaned)
+
+    return form, [{"loc": loc, "msg": msg} for loc, msg in schema_errors.items()], invalid
+
+
+def _file_result(report: dict, field_result: FieldResult):
+    if not field_result.passed:
+        report["rejected"].append(field_result)
+    elif field_result.requires_human_review:
+        report["human_review_required"].append(field_result)
+    else:
+        report["approved"].append(field_result)
+
+
+def apply_guardrails(extracted: dict, audit_fields: dict) -> dict:
     """
     Apply all guardrails to extracted data.
     Returns guardrail report with:
@@ -129,6 +229,18 @@ def apply_guardrails(extracted: dict, audit_fields: list) -> dict:
     - rejected fields
     - fields requiring human review
     """
+    return check_fields(extracted, zip(
+        audit_fields["field"],
+        audit_fields["value"],
+        audit_fields["source_document"]
+    ))
+
+
+def check_fields(extracted: dict, rows) -> dict:
+    """
+    Apply all guardrails to a stream of (field, value, source) rows.
+    Consumes rows once, so they can be produced while the audit is built.
+    """
 
     report = {
         "patient_id": extracted.get("patient_id"),
@@ -136,42 +248,36 @@ def apply_guardrails(extracted: dict, audit_fields: list) -> dict:
         "approved": [],
         "rejected": [],
         "human_review_required": [],
+        "schema_errors": [],
         "guardrail_summary": {}
     }
 
+    # GUARDRAIL 0 — Extraction must match the REDCap schema.
+    # Only the fields (or sections) that fail are rejected.
+    form, report["schema_errors"], invalid = validate_extraction(extracted)
+
     # Check every field
-    for field_audit in audit_fields:
-        field_key = field_audit["field"]
-        value = field_audit["value"]
-        source = field_audit["source_document"]
-        section = field_key.split(".")[0]
+    total_checked = 0
+    for field_key, value, source in rows:
+        total_checked += 1
+        section, _, _ = field_key.partition(".")
 
         passed = True
         reason = "Passed all guardrails"
 
-        # GUARDRAIL 1 — Comorbidity source rule
-        if section == "comorbidities" and value is not None:
-            passed, reason = check_comorbidity_source_rule(
-                field_key, value, source
-            )
-
-        # GUARDRAIL 2 — Medication source rule
-        elif section == "medications" and value is not None:
-            passed, reason = check_medication_source_rule(
-                field_key, value, source
-            )
-
-        # GUARDRAIL 3 — Diagnosis date rule
-        elif field_key == "timeline.date_of_diagnosis":
-            passed, reason = check_diagnosis_date_rule(value)
-
-        # GUARDRAIL 4 — Staging confirmation
-        elif field_key == "staging.overall_stage":
-            passed, reason = check_staging_confirmation_rule(
-                extracted.get("staging", {}).get("t_stage"),
-                extracted.get("staging", {}).get("n_stage"),
-                extracted.get("staging", {}).get("m_stage")
-            )
+        schema_error = invalid.get(field_key)
+
+        if schema_error is not None:
+            passed = False
+            reason = f"REJECTED — failed REDCap schema validation: {schema_error}"
+
+        # GUARDRAILS 1-4 — Source, date and staging rules
+        else:
+            check = FIELD_DISPATCH.get(field_key)
+            if check is None and value is not None:
+                check = SECTION_DISPATCH.get(section)
+            if check is not None:
+                passed, reason = check(form, field_key, value, source)
 
         # GUARDRAIL 5 — Empty beats wrong
         if field_key in EMPTY_BEATS_WRONG and value is None:
@@ -180,24 +286,31 @@ def apply_guardrails(extracted: dict, audit_fields: list) -> dict:
         # GUARDRAIL 6 — Always review list
         needs_review = field_key in ALWAYS_REVIEW
 
-        field_result = {
-            "field": field_key,
-            "value": value,
-            "passed": passed,
-            "reason": reason,
-            "requires_human_review": needs_review
-        }
-
-        if not passed:
-            report["rejected"].append(field_result)
-        elif needs_review:
-            report["human_review_required"].append(field_result)
-        else:
-            report["approved"].append(field_result)
+        _file_result(report, FieldResult(
+            field=field_key,
+            value=value,
+            passed=passed,
+            reason=reason,
+            requires_human_review=needs_review
+        ))
+
+    # A section that isn't an object has no audit rows —
+    # reject each of its REDCap fields so none goes unchecked
+    for section, schema_error in invalid.items():
+        for field in SECTION_FIELDS.get(section, ()):
+            total_checked += 1
+            field_key = f"{section}.{field}"
+            _file_result(report, FieldResult(
+                field=field_key,
+                value=None,
+                passed=False,
+                reason=f"REJECTED — failed REDCap schema validation: {schema_error}",
+                requires_human_review=field_key in ALWAYS_REVIEW
+            ))
 
     # Summary
     report["guardrail_summary"] = {
-        "total_checked": len(audit_fields),
+        "total_checked": total_checked,
         "approved": len(report["approved"]),
         "rejected": len(report["rejected"]),
         "human_review_required": len(report["human_review_required"]),
@@ -229,11 +342,11 @@ if __name__ == "__main__":
     if report["rejected"]:
         print("\n--- REJECTED FIELDS ---")
         for f in report["rejected"]:
-            print(f"  REJECTED: {f['field']}")
-            print(f"  Reason:   {f['reason']}")
+            print(f"  REJECTED: {f.field}")
+            print(f"  Reason:   {f.reason}")
 
     if report["human_review_required"]:
         print("\n--- NEEDS HUMAN REVIEW ---")
         for f in report["human_review_required"]:
-            print(f"  REVIEW:   {f['field']}")
-            print(f"  Value:    {f['value']}")
\ No newline at end of file
+            print(f"  REVIEW:   {f.field}")
+            print(f"  Value:    {f.value}")
\ No newline at end of file
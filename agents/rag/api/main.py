@@ -1,5 +1,8 @@
+import asyncio
 import sys
 import os
+from contextlib import asynccontextmanager
+from dataclasses import asdict
 
 PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 if PROJECT_ROOT not in sys.path:
@@ -10,9 +13,35 @@ load_dotenv()
 
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
-from pipeline import run_pipeline
+from pipeline import run_pipeline, warm_up
+from agents.document_reader import list_patient_documents
+from agents.extractor import USE_MOCK
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Warm up before the first request:
+    open the guidelines store the pipeline
+    uses and run one query,
+    index the patient documents directory
+    and build the shared Gemini client.
+    """
+    try:
+        if not USE_MOCK:
+            from agents.gemini_client import get_client
+            get_client()
+        await asyncio.gather(
+            asyncio.to_thread(warm_up),
+            asyncio.to_thread(list_patient_documents, "")
+        )
+    except Exception as e:
+        print(f"Warmup skipped: {e}")
+    yield
+
 
 app = FastAPI(
+    lifespan=lifespan,
     title="Clinical Data Agent API",
     description="Automates breast cancer REDCap data abstraction from EPIC documents",
     version="1.0.0"
@@ -42,14 +71,14 @@ def health_check():
 
 
 @app.post("/process", response_model=PipelineResponse)
-def process_patient(request: PatientRequest):
+async def process_patient(request: PatientRequest):
     """
     Process a patient's clinical documents.
     Extracts data and pre-fills REDCap form.
     Returns summary with fields ready for review.
     """
     try:
-        result = run_pipeline(request.patient_id)
+        result = await run_pipeline(request.patient_id)
 
         return PipelineResponse(
             patient_id=result["patient_id"],
@@ -73,29 +102,30 @@ def process_patient(request: PatientRequest):
 
 
 @app.get("/patient/{patient_id}/form")
-def get_filled_form(patient_id: str):
+async def get_filled_form(patient_id: str):
     """
     Get the pre-filled REDCap form for a patient.
     """
     try:
-        result = run_pipeline(patient_id)
+        result = await run_pipeline(patient_id)
         return {
             "patient_id": patient_id,
             "form": result["extracted_data"],
             "guardrails": result["guardrail_summary"],
-            "review_required": result["fields_needing_review"]
+            "review_required": [asdict(f) for f in result["fields_needing_review"]],
+            "schema_errors": result["schema_errors"]
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/patient/{patient_id}/guidelines")
-def get_relevant_guidelines(patient_id: str):
+async def get_relevant_guidelines(patient_id: str):
     """
     Get the guidelines relevant to this patient's case.
     """
     try:
-        result = run_pipeline(patient_id)
+        result = await run_pipeline(patient_id)
         return {
             "patient_id": patient_id,
             "relevant_guidelines": result["relevant_guidelines"]
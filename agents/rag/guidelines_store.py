@@ -1,4 +1,6 @@
+import functools
 import os
+import re
 import sys
 
 PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -7,7 +9,15 @@ if PROJECT_ROOT not in sys.path:
 
 import chromadb
 
-# Create persistent ChromaDB store
+# Each rule starts on a line beginning with "RULE "
+RULE_SPLIT = re.compile(r"(?m)^(?=RULE )")
+
+# Guidelines are static at runtime — count them once
+_RULE_COUNT = None
+
+
+# Create persistent ChromaDB store once per process
+@functools.lru_cache(maxsize=1)
 def get_guidelines_store():
     client = chromadb.PersistentClient(path="./rag/guidelines_db")
     collection = client.get_or_create_collection(
@@ -34,43 +44,58 @@ def load_guidelines_into_store():
         content = f.read()
 
     # Split into individual rules
-    rules = []
-    current_rule = []
-
-    for line in content.split("\n"):
-        if line.startswith("RULE ") and current_rule:
-            rules.append("\n".join(current_rule))
-            current_rule = [line]
-        elif line.strip():
-            current_rule.append(line)
-
-    if current_rule:
-        rules.append("\n".join(current_rule))
-
-    # Store each rule with an ID
-    for i, rule in enumerate(rules):
-        rule_id = f"rule_{i:03d}"
-        collection.add(
-            documents=[rule],
-            ids=[rule_id],
-            metadatas=[{"rule_number": i, "source": "breast_cancer_rules.txt"}]
-        )
+    rules = [r.strip() for r in RULE_SPLIT.split(content) if r.strip()]
+
+    # Store all rules in one call — one embedding batch, one write
+    ids = [f"rule_{i:03d}" for i in range(len(rules))]
+    collection.add(
+        documents=rules,
+        ids=ids,
+        metadatas=[
+            {"rule_number": i, "source": "breast_cancer_rules.txt"}
+            for i in range(len(rules))
+        ]
+    )
+    for rule_id, rule in zip(ids, rules):
         print(f"Loaded: {rule_id} — {rule[:60]}...")
 
     print(f"\nTotal rules loaded: {collection.count()}")
+
+    # Store changed — drop cached count and query results
+    global _RULE_COUNT
+    _RULE_COUNT = None
+    _query_guidelines_cached.cache_clear()
+
     return collection
 
 
+def _rule_count(collection) -> int:
+    # Only a loaded store is cached; an empty one is re-checked each time
+    global _RULE_COUNT
+    if _RULE_COUNT:
+        return _RULE_COUNT
+    count = collection.count()
+    if count > 0:
+        _RULE_COUNT = count
+    return count
+
+
 def query_guidelines(question: str, n_results: int = 3) -> list:
     """
     Query guidelines for relevant rules.
     Returns list of matching rules.
     """
+    # Copy the cached rows so callers can't alter them
+    return [dict(r) for r in _query_guidelines_cached(question, n_results)]
+
+
+@functools.lru_cache(maxsize=128)
+def _query_guidelines_cached(question: str, n_results: int) -> tuple:
     collection = get_guidelines_store()
 
     results = collection.query(
         query_texts=[question],
-        n_results=min(n_results, collection.count())
+        n_results=min(n_results, _rule_count(collection))
     )
 
     rules = []
@@ -83,7 +108,7 @@ def query_guidelines(question: str, n_results: int = 3) -> list:
             "rule_number": metadata["rule_number"]
         })
 
-    return rules
+    return tuple(rules)
 
 
 if __name__ == "__main__":
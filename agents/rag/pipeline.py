@@ -1,6 +1,8 @@
+import asyncio
 import json
 import os
 import sys
+import time
 
 # Ensure project root (directory containing 'agents') is on sys.path
 PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -10,14 +12,77 @@ if PROJECT_ROOT not in sys.path:
 from dotenv import load_dotenv
 load_dotenv()
 
-from agents.document_reader import read_patient_documents
-from agents.extractor import extract_clinical_data
-from agents.guardrails import apply_guardrails
-from data.audit.logger import create_audit_log, save_audit_log
+from agents.document_reader import list_patient_documents, read_patient_documents_async
+from agents.extractor import extract_clinical_data_async
+from data.audit.logger import create_audit_and_guardrails, save_audit_log
 from agents.rag.guidelines_store import query_guidelines
 
 
-def run_pipeline(patient_id: str) -> dict:
+# Result cache so /process, /form and /guidelines share one run per patient
+PIPELINE_CACHE_TTL = int(os.getenv("PIPELINE_CACHE_TTL", "300"))
+PIPELINE_CACHE_SIZE = 1024
+
+_PIPE_CACHE: dict[tuple, tuple[float, dict]] = {}
+# patient_id → [lock, holders + waiters]; dropped when nobody uses it
+_PIPE_LOCKS: dict[str, list] = {}
+
+
+def _pipeline_cache_key(patient_id: str) -> tuple:
+    # Any edited, added or removed document changes the key
+    entries = list_patient_documents(patient_id)
+    return (
+        patient_id,
+        tuple(sorted((e.name, os.stat(e.path).st_mtime_ns) for e in entries))
+    )
+
+
+async def run_pipeline(patient_id: str) -> dict:
+    """
+    Run the pipeline for a patient, reusing a recent result
+    if the patient's documents have not changed.
+    Concurrent calls for the same patient share one run.
+    """
+    key = _pipeline_cache_key(patient_id)
+
+    entry = _PIPE_LOCKS.get(patient_id)
+    if entry is None:
+        entry = _PIPE_LOCKS[patient_id] = [asyncio.Lock(), 0]
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            return await _run_pipeline_cached(patient_id, key)
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0:
+            del _PIPE_LOCKS[patient_id]
+
+
+async def _run_pipeline_cached(patient_id: str, key: tuple) -> dict:
+    cached = _PIPE_CACHE.get(key)
+    if cached is not None and cached[0] > time.monotonic():
+        return cached[1]
+
+    result = await _run_pipeline(patient_id)
+
+    if len(_PIPE_CACHE) >= PIPELINE_CACHE_SIZE:
+        _PIPE_CACHE.pop(next(iter(_PIPE_CACHE)))
+    _PIPE_CACHE[key] = (time.monotonic() + PIPELINE_CACHE_TTL, result)
+
+    return result
+
+
+def _audit_and_save(patient_id: str, extracted: dict) -> tuple:
+    # Runs in one worker thread, so the audit write overlaps the guideline query
+    audit, guardrail_report = create_audit_and_guardrails(patient_id, extracted)
+    return audit, guardrail_report, save_audit_log(audit)
+
+
+def warm_up() -> None:
+    """Open the guidelines store this pipeline queries and run one query."""
+    query_guidelines("breast cancer abstraction rules")
+
+
+async def _run_pipeline(patient_id: str) -> dict:
     """
     Complete clinical data abstraction pipeline.
 
@@ -35,33 +100,36 @@ def run_pipeline(patient_id: str) -> dict:
 
     # STEP 1 — Read documents
     print("STEP 1: Reading patient documents...")
-    documents = read_patient_documents(patient_id)
+    documents = await read_patient_documents_async(patient_id)
     print(f"  Loaded {len(documents)} documents\n")
 
     # STEP 2 — Extract clinical data
     print("STEP 2: Extracting clinical data...")
-    extracted = extract_clinical_data(documents, patient_id)
+    extracted = await extract_clinical_data_async(documents, patient_id)
     print(f"  Extraction complete\n")
 
-    # STEP 3 — Audit trail
+    # STEP 3 + 4 — Audit trail and guardrails share one walk over the fields;
+    # STEP 5 — guideline lookup is independent of both
     print("STEP 3: Creating audit trail...")
-    audit = create_audit_log(patient_id, extracted)
-    audit_file = save_audit_log(audit)
-    print(f"  Audit saved: {audit_file}\n")
-
-    # STEP 4 — Guardrails
     print("STEP 4: Applying guardrails...")
-    guardrail_report = apply_guardrails(extracted, audit["fields"])
+    print("STEP 5: Checking relevant guidelines...")
+    # A staging section that failed the schema may not be a dict
+    staging = extracted.get("staging")
+    if not isinstance(staging, dict):
+        staging = {}
+    cancer_type = staging.get("primary_cancer", "breast cancer")
+    (audit, guardrail_report, audit_file), guidelines = await asyncio.gather(
+        asyncio.to_thread(_audit_and_save, patient_id, extracted),
+        asyncio.to_thread(query_guidelines, f"{cancer_type} abstraction rules")
+    )
+    print(f"  Found {len(guidelines)} relevant guidelines\n")
+
     summary = guardrail_report["guardrail_summary"]
     print(f"  Approved:              {summary['approved']}")
     print(f"  Rejected:              {summary['rejected']}")
     print(f"  Human review needed:   {summary['human_review_required']}\n")
 
-    # STEP 5 — Query relevant guidelines
-    print("STEP 5: Checking relevant guidelines...")
-    cancer_type = extracted.get("staging", {}).get("primary_cancer", "breast cancer")
-    guidelines = query_guidelines(f"{cancer_type} abstraction rules")
-    print(f"  Found {len(guidelines)} relevant guidelines\n")
+    print(f"  Audit saved: {audit_file}\n")
 
     # STEP 6 — Build final result
     final_result = {
@@ -73,7 +141,8 @@ def run_pipeline(patient_id: str) -> dict:
         "relevant_guidelines": [g["rule"][:100] for g in guidelines],
         "action_required": summary["requires_manual_action"] > 0,
         "fields_safe_to_populate": summary["safe_to_auto_populate"],
-        "fields_needing_review": guardrail_report["human_review_required"]
+        "fields_needing_review": guardrail_report["human_review_required"],
+        "schema_errors": guardrail_report["schema_errors"]
     }
 
     print(f"{'='*50}")
@@ -87,11 +156,11 @@ def run_pipeline(patient_id: str) -> dict:
 
 
 if __name__ == "__main__":
-    result = run_pipeline("patient_001")
+    result = asyncio.run(run_pipeline("patient_001"))
 
     print("\n--- FINAL EXTRACTED FORM ---")
     print(json.dumps(result["extracted_data"], indent=2))
 
     print("\n--- FIELDS NEEDING HUMAN REVIEW ---")
     for field in result["fields_needing_review"]:
-        print(f"  {field['field']}: {field['value']}")
\ No newline at end of file
+        print(f"  {field.field}: {field.value}")
\ No newline at end of file
@@ -1,5 +1,8 @@
+import asyncio
 import sys
 import os
+from contextlib import asynccontextmanager
+from dataclasses import asdict
 
 PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 if PROJECT_ROOT not in sys.path:
@@ -10,19 +13,53 @@ load_dotenv()
 
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
-from pipeline import run_pipeline
+from pipeline import GEMINI_CONCURRENCY, run_pipeline, run_pipeline_many, warm_up
+from agents.document_reader import list_patient_documents
+from agents.extractor import USE_MOCK
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Warm up before the first request:
+    open the guidelines store the pipeline
+    uses and run one query,
+    index the patient documents directory
+    and build the shared Gemini client.
+    """
+    try:
+        if not USE_MOCK:
+            from agents.gemini_client import get_client
+            get_client()
+        await asyncio.gather(
+            asyncio.to_thread(warm_up),
+            asyncio.to_thread(list_patient_documents, "")
+        )
+    except Exception as e:
+        print(f"Warmup skipped: {e}")
+    yield
+
 
 app = FastAPI(
+    lifespan=lifespan,
     title="Clinical Data Agent API",
     description="Automates breast cancer REDCap abstraction from EPIC documents",
     version="1.0.0"
 )
 
 
+# One Gemini concurrency limit shared by every /process_batch request
+_gemini_slots = asyncio.Semaphore(GEMINI_CONCURRENCY)
+
+
 class PatientRequest(BaseModel):
     patient_id: str
 
 
+class BatchRequest(BaseModel):
+    patient_ids: list[str]
+
+
 @app.get("/health")
 def health_check():
     return {
@@ -33,9 +70,9 @@ def health_check():
 
 
 @app.post("/process")
-def process_patient(request: PatientRequest):
+async def process_patient(request: PatientRequest):
     try:
-        result = run_pipeline(request.patient_id)
+        result = await run_pipeline(request.patient_id)
         return {
             "patient_id": result["patient_id"],
             "status": result["status"],
@@ -50,15 +87,49 @@ def process_patient(request: PatientRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/process_batch")
+async def process_batch(request: BatchRequest):
+    """
+    Process many patients concurrently.
+    At most GEMINI_CONCURRENCY extractions run at once,
+    paced to GEMINI_QPM.
+    """
+    results = await run_pipeline_many(request.patient_ids, _gemini_slots)
+
+    processed = []
+    failed = []
+    for result in results:
+        if result["status"] == "FAILED":
+            failed.append({"patient_id": result["patient_id"], "error": result["error"]})
+            continue
+
+        processed.append({
+            "patient_id": result["patient_id"],
+            "status": result["status"],
+            "fields_safe_to_populate": result["fields_safe_to_populate"],
+            "fields_needing_review": result["guardrail_summary"]["human_review_required"],
+            "action_required": result["action_required"]
+        })
+
+    return {
+        "total": len(request.patient_ids),
+        "processed": len(processed),
+        "failed": len(failed),
+        "results": processed,
+        "errors": failed
+    }
+
+
 @app.get("/patient/{patient_id}/form")
-def get_filled_form(patient_id: str):
+async def get_filled_form(patient_id: str):
     try:
-        result = run_pipeline(patient_id)
+        result = await run_pipeline(patient_id)
         return {
             "patient_id": patient_id,
             "form": result["extracted_data"],
             "guardrails": result["guardrail_summary"],
-            "review_required": result["fields_needing_review"]
+            "review_required": [asdict(f) for f in result["fields_needing_review"]],
+            "schema_errors": result["schema_errors"]
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
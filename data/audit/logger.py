@@ -1,127 +1,221 @@
 import json
 import os
 from datetime import datetime
-
-
-def create_audit_log(patient_id: str, extracted: dict) -> dict:
+from types import MappingProxyType
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Set once the audit output directory has been created
+_AUDIT_DIR_READY = False
+
+# Audit fields are stored column-wise: one list per attribute
+AUDIT_COLUMNS = ("field", "value", "status", "confidence", "source_document", "rule_applied")
+
+# (status, confidence) for a field, chosen only by whether it has a value
+STATUS_POPULATED = "POPULATED"
+_POPULATED = (STATUS_POPULATED, "HIGH - extracted from source document")
+_EMPTY = ("EMPTY - not found in documents", "N/A")
+
+# Rule applied to each field
+FIELD_RULES = MappingProxyType({
+    "timeline.date_of_diagnosis": "RULE 008 - Date of diagnosis = pathology confirmation date only",
+    "timeline.date_of_last_visit": "RULE 008 - Most recent visit date from MD notes",
+    "timeline.date_of_last_scan": "RULE 008 - Most recent imaging date from radiology",
+    "timeline.date_of_death": "RULE 008 - Date of death from patient record",
+    "staging.primary_cancer": "RULE 004 - Cancer type confirmed by pathology",
+    "staging.laterality": "RULE 002 - Laterality from pathology and imaging",
+    "staging.t_stage": "RULE 004 - T stage confirmed by imaging AND MD note",
+    "staging.n_stage": "RULE 004 - N stage confirmed by imaging AND MD note",
+    "staging.m_stage": "RULE 004 - M stage confirmed by PET-CT",
+    "staging.overall_stage": "RULE 004 - Stage group from TNM combination",
+    "staging.metastasis": "RULE 009 - Metastasis confirmed by PET-CT + MD documentation",
+    "pathology.specimen_site": "RULE 002 - Specimen site from pathology report",
+    "pathology.quadrant": "RULE 002 - Quadrant from pathology report",
+    "pathology.er_status": "RULE 003 - ER status from IHC in pathology report",
+    "pathology.pr_status": "RULE 003 - PR status from IHC in pathology report",
+    "pathology.her2_status": "RULE 003 - HER2 status from IHC/FISH in pathology report",
+    "pathology.ki67_percentage": "RULE 003 - Ki67 from pathology report",
+    "pathology.grade": "RULE 003 - Grade from pathology report",
+    "pathology.diagnosis": "RULE 003 - Full diagnosis from pathology report",
+    "comorbidities.hypertension": "RULE 001 - ONLY from MD note within first 3-6 months",
+    "comorbidities.diabetes": "RULE 001 - ONLY from MD note within first 3-6 months",
+    "comorbidities.hypothyroidism": "RULE 001 - ONLY from MD note within first 3-6 months",
+    "comorbidities.other": "RULE 001 - ONLY from MD note within first 3-6 months",
+    "germline.brca1_status": "RULE 005 - ONLY from official genetic testing report",
+    "germline.brca2_status": "RULE 005 - ONLY from official genetic testing report",
+    "germline.variant_found": "RULE 005 - ONLY from official genetic testing report",
+    "germline.classification": "RULE 005 - ONLY from official genetic testing report",
+    "medications.line_of_treatment": "RULE 006 - ONLY from MD notes",
+    "medications.intent": "RULE 006 - ONLY from MD notes",
+    "medications.regimen": "RULE 006 - ONLY from MD notes",
+    "medications.drugs": "RULE 006 - ONLY from MD notes"
+})
+
+
+def _group_rules_by_section(rules) -> dict:
+    grouped = {}
+    for field_key, rule in rules.items():
+        section, _, field = field_key.partition(".")
+        grouped.setdefault(section, {})[field] = rule
+    return grouped
+
+
+# FIELD_RULES keyed section → field → rule
+_RULES_BY_SECTION = _group_rules_by_section(FIELD_RULES)
+
+# Source document for each section
+SOURCE_MAP = MappingProxyType({
+    "timeline": "patient_record + md_notes + radiology",
+    "staging": "md_note_visit2 + radiology + pathology",
+    "pathology": "patient_001_pathology.txt",
+    "comorbidities": "patient_001_md_note_visit1.txt (Visit 1 - within 3-6 months)",
+    "germline": "patient_001_germline.txt",
+    "medications": "patient_001_md_note_visit2.txt (MD notes only)"
+})
+
+
+def iter_audit_fields(extracted: dict):
     """
-    Creates audit trail for every extracted field.
-    Shows WHERE each value came from and WHY.
-    This is what makes clinical AI trustworthy.
+    Walks every extracted field once.
+    Yields one audit row per field, in AUDIT_COLUMNS order.
     """
+    for section, values in extracted.items():
+        if section == "patient_id" or not isinstance(values, dict):
+            continue
 
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        # Same for every field in the section
+        prefix = section + "."
+        section_rules = _RULES_BY_SECTION.get(section, {})
+        source = SOURCE_MAP.get(section, "Unknown source")
 
-    audit = {
-        "patient_id": patient_id,
-        "processed_at": timestamp,
-        "mode": "MOCK" if os.getenv("USE_MOCK_GEMINI") == "1" else "LIVE",
-        "fields": []
-    }
+        for field, value in values.items():
+            rule = section_rules.get(field, "No specific rule")
+            status, confidence = _EMPTY if value is None else _POPULATED
 
-    # Define rules for each field
-    field_rules = {
-        "timeline.date_of_diagnosis": "RULE 008 - Date of diagnosis = pathology confirmation date only",
-        "timeline.date_of_last_visit": "RULE 008 - Most recent visit date from MD notes",
-        "timeline.date_of_last_scan": "RULE 008 - Most recent imaging date from radiology",
-        "timeline.date_of_death": "RULE 008 - Date of death from patient record",
-        "staging.primary_cancer": "RULE 004 - Cancer type confirmed by pathology",
-        "staging.laterality": "RULE 002 - Laterality from pathology and imaging",
-        "staging.t_stage": "RULE 004 - T stage confirmed by imaging AND MD note",
-        "staging.n_stage": "RULE 004 - N stage confirmed by imaging AND MD note",
-        "staging.m_stage": "RULE 004 - M stage confirmed by PET-CT",
-        "staging.overall_stage": "RULE 004 - Stage group from TNM combination",
-        "staging.metastasis": "RULE 009 - Metastasis confirmed by PET-CT + MD documentation",
-        "pathology.specimen_site": "RULE 002 - Specimen site from pathology report",
-        "pathology.quadrant": "RULE 002 - Quadrant from pathology report",
-        "pathology.er_status": "RULE 003 - ER status from IHC in pathology report",
-        "pathology.pr_status": "RULE 003 - PR status from IHC in pathology report",
-        "pathology.her2_status": "RULE 003 - HER2 status from IHC/FISH in pathology report",
-        "pathology.ki67_percentage": "RULE 003 - Ki67 from pathology report",
-        "pathology.grade": "RULE 003 - Grade from pathology report",
-        "pathology.diagnosis": "RULE 003 - Full diagnosis from pathology report",
-        "comorbidities.hypertension": "RULE 001 - ONLY from MD note within first 3-6 months",
-        "comorbidities.diabetes": "RULE 001 - ONLY from MD note within first 3-6 months",
-        "comorbidities.hypothyroidism": "RULE 001 - ONLY from MD note within first 3-6 months",
-        "comorbidities.other": "RULE 001 - ONLY from MD note within first 3-6 months",
-        "germline.brca1_status": "RULE 005 - ONLY from official genetic testing report",
-        "germline.brca2_status": "RULE 005 - ONLY from official genetic testing report",
-        "germline.variant_found": "RULE 005 - ONLY from official genetic testing report",
-        "germline.classification": "RULE 005 - ONLY from official genetic testing report",
-        "medications.line_of_treatment": "RULE 006 - ONLY from MD notes",
-        "medications.intent": "RULE 006 - ONLY from MD notes",
-        "medications.regimen": "RULE 006 - ONLY from MD notes",
-        "medications.drugs": "RULE 006 - ONLY from MD notes"
-    }
+            yield prefix + field, value, status, confidence, source, rule
 
-    # Source document mapping
-    source_map = {
-        "timeline": "patient_record + md_notes + radiology",
-        "staging": "md_note_visit2 + radiology + pathology",
-        "pathology": "patient_001_pathology.txt",
-        "comorbidities": "patient_001_md_note_visit1.txt (Visit 1 - within 3-6 months)",
-        "germline": "patient_001_germline.txt",
-        "medications": "patient_001_md_note_visit2.txt (MD notes only)"
-    }
 
-    # Walk through every field and log it
-    for section, values in extracted.items():
-        if section == "patient_id":
-            continue
+def _new_audit(patient_id: str) -> dict:
+    return {
+        "patient_id": patient_id,
+        "processed_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "mode": "MOCK" if os.getenv("USE_MOCK_GEMINI") == "1" else "LIVE",
+        "fields": {column: [] for column in AUDIT_COLUMNS}
+    }
 
-        if isinstance(values, dict):
-            for field, value in values.items():
-                field_key = f"{section}.{field}"
-                rule = field_rules.get(field_key, "No specific rule")
-                source = source_map.get(section, "Unknown source")
-
-                if value is None:
-                    status = "EMPTY - not found in documents"
-                    confidence = "N/A"
-                else:
-                    status = "POPULATED"
-                    confidence = "HIGH - extracted from source document"
-
-                audit["fields"].append({
-                    "field": field_key,
-                    "value": value,
-                    "status": status,
-                    "confidence": confidence,
-                    "source_document": source,
-                    "rule_applied": rule
-                })
-
-    # Summary stats
-    populated = sum(1 for f in audit["fields"] if f["status"] == "POPULATED")
-    empty = sum(1 for f in audit["fields"] if "EMPTY" in f["status"])
 
+def _record_fields(audit: dict, rows):
+    # Store each row in the audit columns and pass (field, value, source) on
+    fields = audit["fields"]
+    field_col, value_col, status_col, confidence_col, source_col, rule_col = (
+        fields[column] for column in AUDIT_COLUMNS
+    )
+    for field_key, value, status, confidence, source, rule in rows:
+        field_col.append(field_key)
+        value_col.append(value)
+        status_col.append(status)
+        confidence_col.append(confidence)
+        source_col.append(source)
+        rule_col.append(rule)
+        yield field_key, value, source
+
+
+def _summarize(audit: dict) -> dict:
+    # Summary stats (a field is either POPULATED or EMPTY)
+    statuses = audit["fields"]["status"]
+    total = len(statuses)
+    populated = statuses.count(STATUS_POPULATED)
+    empty = total - populated
     audit["summary"] = {
-        "total_fields": len(audit["fields"]),
+        "total_fields": total,
         "populated": populated,
         "empty": empty,
-        "completion_rate": f"{(populated / len(audit['fields']) * 100):.1f}%"
+        "completion_rate": f"{(populated / total * 100):.1f}%"
     }
 
     return audit
 
 
-def save_audit_log(audit: dict) -> str:
-    """Save audit log to file"""
-    os.makedirs("audit", exist_ok=True)
-    filename = f"audit/audit_{audit['patient_id']}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+def create_audit_log(patient_id: str, extracted: dict) -> dict:
+    """
+    Creates audit trail for every extracted field.
+    Shows WHERE each value came from and WHY.
+    This is what makes clinical AI trustworthy.
+    """
+    audit = _new_audit(patient_id)
+    for _ in _record_fields(audit, iter_audit_fields(extracted)):
+        pass
+
+    return _summarize(audit)
+
 
-    with open(filename, "w") as f:
-        json.dump(audit, f, indent=2)
+def create_audit_and_guardrails(patient_id: str, extracted: dict) -> tuple:
+    """
+    Builds the audit trail and the guardrail report in one walk
+    over the extracted fields. Returns (audit, guardrail_report).
+    """
+    from agents.guardrails import check_fields
 
-    print(f"Audit log saved: {filename}")
+    audit = _new_audit(patient_id)
+    report = check_fields(extracted, _record_fields(audit, iter_audit_fields(extracted)))
+
+    return _summarize(audit), report
+
+
+def iter_audit_rows(fields: dict):
+    """
+    Row view over the column-wise audit fields.
+    Yields one AuditField per field.
+    """
+    from models.audit_record import AuditField
+
+    for row in zip(*(fields[column] for column in AUDIT_COLUMNS)):
+        yield AuditField(*row)
+
+
+def save_audit_log(audit: dict, verbose: bool = True) -> str:
+    """Save audit log to file"""
+    global _AUDIT_DIR_READY
+    if not _AUDIT_DIR_READY:
+        os.makedirs("audit", exist_ok=True)
+        _AUDIT_DIR_READY = True
+    # Reuse the audit's own timestamp so body and filename always agree
+    stamp = audit["processed_at"].replace("-", "").replace(":", "").replace(" ", "_")
+    filename = f"audit/audit_{audit['patient_id']}_{stamp}.json"
+
+    # Audit files keep one record per field
+    fields = audit["fields"]
+    record = {**audit, "fields": [
+        dict(zip(AUDIT_COLUMNS, row))
+        for row in zip(*(fields[column] for column in AUDIT_COLUMNS))
+    ]}
+
+    # Serialize once, then hand the whole buffer to the kernel in one write
+    if orjson is not None:
+        data = orjson.dumps(record, option=orjson.OPT_INDENT_2)
+    else:
+        data = json.dumps(record, indent=2).encode()
+
+    fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+    finally:
+        os.close(fd)
+
+    if verbose:
+        print(f"Audit log saved: {filename}")
     return filename
 
 
 if __name__ == "__main__":
-    import sys
-    sys.path.append(".")
+    # Test with mock data; run from the project root: python -m data.audit.logger
+    from itertools import islice
 
-    # Test with mock data
     from agents.document_reader import read_patient_documents
     from agents.extractor import extract_clinical_data
 
@@ -138,9 +232,9 @@ if __name__ == "__main__":
     print(f"Completion rate: {audit['summary']['completion_rate']}")
 
     print(f"\n--- SAMPLE FIELD AUDIT ---")
-    for field in audit["fields"][:3]:
-        print(f"\nField:    {field['field']}")
-        print(f"Value:    {field['value']}")
-        print(f"Status:   {field['status']}")
-        print(f"Source:   {field['source_document']}")
-        print(f"Rule:     {field['rule_applied']}")
\ No newline at end of file
+    for field in islice(iter_audit_rows(audit["fields"]), 3):
+        print(f"\nField:    {field.field}")
+        print(f"Value:    {field.value}")
+        print(f"Status:   {field.status}")
+        print(f"Source:   {field.source_document}")
+        print(f"Rule:     {field.rule_applied}")
\ No newline at end of file
@@ -0,0 +1,21 @@
+from dataclasses import dataclass
+from typing import Optional
+
+
+@dataclass(slots=True)
+class AuditField:
+    field: str
+    value: Optional[list[str] | str]
+    status: str
+    confidence: str
+    source_document: str
+    rule_applied: str
+
+
+@dataclass(slots=True)
+class FieldResult:
+    field: str
+    value: Optional[list[str] | str]
+    passed: bool
+    reason: str
+    requires_human_review: bool
@@ -1,7 +1,21 @@
-from pydantic import BaseModel
+from dataclasses import asdict, dataclass, field
 from typing import Optional
 
-class PathologyFindings(BaseModel):
+from pydantic import ConfigDict
+
+
+class _Form:
+    __slots__ = ()
+
+    # Gemini may return numbers for text fields (e.g. ki67_percentage: 35)
+    __pydantic_config__ = ConfigDict(coerce_numbers_to_str=True)
+
+    def model_dump(self) -> dict:
+        return asdict(self)
+
+
+@dataclass(slots=True)
+class PathologyFindings(_Form):
     specimen_site: Optional[str] = None
     quadrant: Optional[str] = None
     er_status: Optional[str] = None
@@ -11,7 +25,9 @@ class PathologyFindings(BaseModel):
     grade: Optional[str] = None
     diagnosis: Optional[str] = None
 
-class StagingForm(BaseModel):
+
+@dataclass(slots=True)
+class StagingForm(_Form):
     primary_cancer: Optional[str] = None
     laterality: Optional[str] = None
     t_stage: Optional[str] = None
@@ -20,38 +36,70 @@ class StagingForm(BaseModel):
     overall_stage: Optional[str] = None
     metastasis: Optional[str] = None
 
-class TimelineForm(BaseModel):
+
+@dataclass(slots=True)
+class TimelineForm(_Form):
     date_of_diagnosis: Optional[str] = None
     date_of_last_visit: Optional[str] = None
     date_of_last_scan: Optional[str] = None
     date_of_death: Optional[str] = None
 
-class ComorbidityForm(BaseModel):
+
+@dataclass(slots=True)
+class ComorbidityForm(_Form):
     hypertension: Optional[str] = None
     diabetes: Optional[str] = None
     hypothyroidism: Optional[str] = None
     other: Optional[str] = None
 
-class GermlineForm(BaseModel):
+
+@dataclass(slots=True)
+class GermlineForm(_Form):
     brca1_status: Optional[str] = None
     brca2_status: Optional[str] = None
     variant_found: Optional[str] = None
     classification: Optional[str] = None
 
-class MedicationForm(BaseModel):
+
+@dataclass(slots=True)
+class MedicationForm(_Form):
     line_of_treatment: Optional[str] = None
     intent: Optional[str] = None
     regimen: Optional[str] = None
-    drugs: Optional[str] = None
+    drugs: Optional[list[str] | str] = None
+
 
-class REDCapForm(BaseModel):
+@dataclass(slots=True)
+class REDCapForm(_Form):
     patient_id: str
-    timeline: TimelineForm = TimelineForm()
-    staging: StagingForm = StagingForm()
-    pathology: PathologyFindings = PathologyFindings()
-    comorbidities: ComorbidityForm = ComorbidityForm()
-    germline: GermlineForm = GermlineForm()
-    medications: MedicationForm = MedicationForm()
+    timeline: TimelineForm = field(default_factory=TimelineForm)
+    staging: StagingForm = field(default_factory=StagingForm)
+    pathology: PathologyFindings = field(default_factory=PathologyFindings)
+    comorbidities: ComorbidityForm = field(default_factory=ComorbidityForm)
+    germline: GermlineForm = field(default_factory=GermlineForm)
+    medications: MedicationForm = field(default_factory=MedicationForm)
+
+
+def _subform(cls, values: Optional[dict]):
+    if not values:
+        return cls()
+    return cls(**{k: v for k, v in values.items() if k in cls.__dataclass_fields__})
+
+
+def build_form_fast(patient_id: str, extracted: dict) -> REDCapForm:
+    """
+    Build a REDCapForm straight from the extraction — no validation.
+    Only use on values that already passed REDCap schema validation.
+    """
+    return REDCapForm(
+        patient_id=patient_id,
+        timeline=_subform(TimelineForm, extracted.get("timeline")),
+        staging=_subform(StagingForm, extracted.get("staging")),
+        pathology=_subform(PathologyFindings, extracted.get("pathology")),
+        comorbidities=_subform(ComorbidityForm, extracted.get("comorbidities")),
+        germline=_subform(GermlineForm, extracted.get("germline")),
+        medications=_subform(MedicationForm, extracted.get("medications"))
+    )
 
 
 # Test it
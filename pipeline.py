@@ -1,51 +1,159 @@
+import asyncio
 import json
 import os
-import sys
-
-PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
-if PROJECT_ROOT not in sys.path:
-    sys.path.append(PROJECT_ROOT)
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
 
 from dotenv import load_dotenv
 load_dotenv()
 
-from agents.document_reader import read_patient_documents
-from agents.extractor import extract_clinical_data
-from agents.guardrails import apply_guardrails
-from audit.logger import create_audit_log, save_audit_log
-from rag.guidelines_store import query_guidelines
+from agents.document_reader import list_patient_documents, read_patient_documents_async
+from agents.extractor import USE_MOCK, extract_clinical_data_async
+from audit.logger import create_audit_and_guardrails, save_audit_log
+
+
+# Result cache so /process, /form and /guidelines share one run per patient
+PIPELINE_CACHE_TTL = int(os.getenv("PIPELINE_CACHE_TTL", "300"))
+PIPELINE_CACHE_SIZE = 1024
+
+_PIPE_CACHE: dict[tuple, tuple[float, dict]] = {}
+# patient_id → [lock, holders + waiters]; dropped when nobody uses it
+_PIPE_LOCKS: dict[str, list] = {}
+
+# Batch limits — size these to the Gemini quota
+GEMINI_CONCURRENCY = int(os.getenv("GEMINI_CONCURRENCY", "20"))
+GEMINI_QPM = int(os.getenv("GEMINI_QPM", "0"))  # 0 = no per-minute limit
+
+_next_start = 0.0
+
+
+def _pipeline_cache_key(patient_id: str) -> tuple:
+    # Any edited, added or removed document changes the key
+    entries = list_patient_documents(patient_id)
+    return (
+        patient_id,
+        tuple(sorted((e.name, os.stat(e.path).st_mtime_ns) for e in entries))
+    )
+
+
+def _quiet(*args, **kwargs):
+    pass
+
+
+@asynccontextmanager
+async def _patient_lock(patient_id: str):
+    # One run per patient at a time; the entry is dropped when nobody uses it
+    entry = _PIPE_LOCKS.get(patient_id)
+    if entry is None:
+        entry = _PIPE_LOCKS[patient_id] = [asyncio.Lock(), 0]
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0:
+            del _PIPE_LOCKS[patient_id]
+
+
+def _cached_result(key: tuple) -> dict | None:
+    cached = _PIPE_CACHE.get(key)
+    if cached is not None and cached[0] > time.monotonic():
+        return cached[1]
+    return None
+
+
+def _store_result(key: tuple, result: dict):
+    if len(_PIPE_CACHE) >= PIPELINE_CACHE_SIZE:
+        _PIPE_CACHE.pop(next(iter(_PIPE_CACHE)))
+    _PIPE_CACHE[key] = (time.monotonic() + PIPELINE_CACHE_TTL, result)
+
+
+async def run_pipeline(patient_id: str, verbose: bool = True) -> dict:
+    """
+    Run the pipeline for a patient, reusing a recent result
+    if the patient's documents have not changed.
+    Concurrent calls for the same patient share one run.
+    """
+    key = _pipeline_cache_key(patient_id)
+
+    async with _patient_lock(patient_id):
+        result = _cached_result(key)
+        if result is None:
+            result = await _run_pipeline(patient_id, verbose)
+            _store_result(key, result)
+
+        return result
+
+
+async def _run_pipeline(patient_id: str, verbose: bool = True) -> dict:
+    log = print if verbose else _quiet
+
+    log(f"\n{'='*50}")
+    log(f"CLINICAL DATA AGENT — Patient: {patient_id}")
+    log(f"{'='*50}\n")
+
+    extracted = await _read_and_extract(patient_id, verbose)
+    return await _complete_pipeline(patient_id, extracted, verbose)
+
+
+async def _read_and_extract(patient_id: str, verbose: bool) -> dict:
+    log = print if verbose else _quiet
+
+    log("STEP 1: Reading patient documents...")
+    documents = await read_patient_documents_async(patient_id, verbose)
+    log(f"  Loaded {len(documents)} documents\n")
+
+    log("STEP 2: Extracting clinical data...")
+    extracted = await extract_clinical_data_async(documents, patient_id, verbose)
+    log(f"  Extraction complete\n")
+
+    return extracted
+
 
+def _guidelines_question(extracted: dict) -> str:
+    # A staging section that failed the schema may not be a dict
+    staging = extracted.get("staging")
+    if not isinstance(staging, dict):
+        staging = {}
+    cancer_type = staging.get("primary_cancer", "breast cancer")
+    return f"{cancer_type} abstraction rules"
 
-def run_pipeline(patient_id: str) -> dict:
 
-    print(f"\n{'='*50}")
-    print(f"CLINICAL DATA AGENT — Patient: {patient_id}")
-    print(f"{'='*50}\n")
+def _audit_and_save(patient_id: str, extracted: dict, verbose: bool) -> tuple:
+    # Runs in one worker thread, so the audit write overlaps the guideline query
+    audit, guardrail_report = create_audit_and_guardrails(patient_id, extracted)
+    return audit, guardrail_report, save_audit_log(audit, verbose)
 
-    print("STEP 1: Reading patient documents...")
-    documents = read_patient_documents(patient_id)
-    print(f"  Loaded {len(documents)} documents\n")
 
-    print("STEP 2: Extracting clinical data...")
-    extracted = extract_clinical_data(documents, patient_id)
-    print(f"  Extraction complete\n")
+async def _complete_pipeline(patient_id: str, extracted: dict, verbose: bool, guidelines: list | None = None) -> dict:
+    log = print if verbose else _quiet
 
-    print("STEP 3: Creating audit trail...")
-    audit = create_audit_log(patient_id, extracted)
-    audit_file = save_audit_log(audit)
-    print(f"  Audit saved: {audit_file}\n")
+    log("STEP 3: Creating audit trail...")
+    log("STEP 4: Applying guardrails...")
+    log("STEP 5: Checking relevant guidelines...")
+    if guidelines is None:
+        # Imported here so importing pipeline doesn't pull in chromadb
+        from rag.guidelines_store import query_guidelines
+
+        (audit, guardrail_report, audit_file), guidelines = await asyncio.gather(
+            asyncio.to_thread(_audit_and_save, patient_id, extracted, verbose),
+            asyncio.to_thread(query_guidelines, _guidelines_question(extracted), truncate=100)
+        )
+    else:
+        audit, guardrail_report, audit_file = await asyncio.to_thread(
+            _audit_and_save, patient_id, extracted, verbose
+        )
+
+    log(f"  Found {len(guidelines)} relevant guidelines\n")
 
-    print("STEP 4: Applying guardrails...")
-    guardrail_report = apply_guardrails(extracted, audit["fields"])
     summary = guardrail_report["guardrail_summary"]
-    print(f"  Approved:              {summary['approved']}")
-    print(f"  Rejected:              {summary['rejected']}")
-    print(f"  Human review needed:   {summary['human_review_required']}\n")
+    log(f"  Approved:              {summary['approved']}")
+    log(f"  Rejected:              {summary['rejected']}")
+    log(f"  Human review needed:   {summary['human_review_required']}\n")
 
-    print("STEP 5: Checking relevant guidelines...")
-    cancer_type = extracted.get("staging", {}).get("primary_cancer", "breast cancer")
-    guidelines = query_guidelines(f"{cancer_type} abstraction rules")
-    print(f"  Found {len(guidelines)} relevant guidelines\n")
+    log(f"  Audit saved: {audit_file}\n")
 
     final_result = {
         "patient_id": patient_id,
@@ -53,23 +161,147 @@ def run_pipeline(patient_id: str) -> dict:
         "extracted_data": extracted,
         "audit_file": audit_file,
         "guardrail_summary": summary,
-        "relevant_guidelines": [g["rule"][:100] for g in guidelines],
+        "relevant_guidelines": [g["rule"] for g in guidelines],
         "action_required": summary["requires_manual_action"] > 0,
         "fields_safe_to_populate": summary["safe_to_auto_populate"],
-        "fields_needing_review": guardrail_report["human_review_required"]
+        "fields_needing_review": guardrail_report["human_review_required"],
+        "schema_errors": guardrail_report["schema_errors"]
     }
 
-    print(f"{'='*50}")
-    print(f"PIPELINE COMPLETE")
-    print(f"Safe to auto-populate:  {summary['safe_to_auto_populate']} fields")
-    print(f"Needs human review:     {summary['human_review_required']} fields")
-    print(f"Rejected:               {summary['rejected']} fields")
-    print(f"{'='*50}\n")
+    log(f"{'='*50}")
+    log(f"PIPELINE COMPLETE")
+    log(f"Safe to auto-populate:  {summary['safe_to_auto_populate']} fields")
+    log(f"Needs human review:     {summary['human_review_required']} fields")
+    log(f"Rejected:               {summary['rejected']} fields")
+    log(f"{'='*50}\n")
 
     return final_result
 
 
+def _failed(patient_id: str, error: BaseException) -> dict:
+    return {"patient_id": patient_id, "status": "FAILED", "error": str(error)}
+
+
+def _run_pipeline_quiet(patient_id: str) -> dict:
+    try:
+        return asyncio.run(run_pipeline(patient_id, verbose=False))
+    except Exception as e:
+        return _failed(patient_id, e)
+
+
+def warm_up() -> None:
+    """Open the guidelines store this pipeline queries and run one query."""
+    from rag.guidelines_store import query_guidelines
+
+    query_guidelines("breast cancer abstraction rules")
+
+
+async def wait_for_rate_limit():
+    """
+    Space out extractions evenly so batches
+    never exceed GEMINI_QPM requests per minute.
+    """
+    global _next_start
+    if GEMINI_QPM <= 0:
+        return
+
+    # Nothing is awaited between reading and advancing _next_start,
+    # so concurrent callers on the event loop can't interleave here
+    now = time.monotonic()
+    wait = _next_start - now
+    _next_start = max(now, _next_start) + 60 / GEMINI_QPM
+
+    if wait > 0:
+        await asyncio.sleep(wait)
+
+
+async def run_pipeline_many(patient_ids: list, slots: asyncio.Semaphore | None = None) -> list:
+    """
+    Run the pipeline for many patients on this event loop.
+    Returns results in the same order as patient_ids; a patient
+    that fails gets {"patient_id", "status": "FAILED", "error"}.
+
+    Extractions go through slots (default GEMINI_CONCURRENCY at
+    once) and are paced to GEMINI_QPM. Pass a shared semaphore to
+    hold several batches to one limit. The guidelines for the
+    whole batch come from one query.
+    """
+    from rag.guidelines_store import query_guidelines_batch
+
+    if slots is None:
+        slots = asyncio.Semaphore(GEMINI_CONCURRENCY)
+    loop = asyncio.get_running_loop()
+
+    # Each patient reports its guideline question (None if it needs none),
+    # then waits for the one batch query that covers them all
+    unique_ids = list(dict.fromkeys(patient_ids))
+    asked = {pid: loop.create_future() for pid in unique_ids}
+
+    async def _ask_all() -> dict:
+        questions = list(dict.fromkeys(
+            q for q in await asyncio.gather(*asked.values()) if q is not None
+        ))
+        if not questions:
+            return {}
+        answers = await asyncio.to_thread(query_guidelines_batch, questions, truncate=100)
+        return dict(zip(questions, answers))
+
+    guidelines_for = asyncio.ensure_future(_ask_all())
+
+    async def _one(patient_id: str) -> dict:
+        try:
+            key = _pipeline_cache_key(patient_id)
+            async with _patient_lock(patient_id):
+                result = _cached_result(key)
+                if result is not None:
+                    return result
+
+                async with slots:
+                    await wait_for_rate_limit()
+                    extracted = await _read_and_extract(patient_id, False)
+                question = _guidelines_question(extracted)
+                asked[patient_id].set_result(question)
+
+                guidelines = (await guidelines_for)[question]
+                result = await _complete_pipeline(patient_id, extracted, False, guidelines)
+                _store_result(key, result)
+                return result
+        finally:
+            if not asked[patient_id].done():
+                asked[patient_id].set_result(None)
+
+    # A failed patient doesn't cost the rest of the batch their results
+    results = await asyncio.gather(*[_one(pid) for pid in unique_ids], return_exceptions=True)
+    await asyncio.gather(guidelines_for, return_exceptions=True)
+    by_id = {
+        pid: _failed(pid, result) if isinstance(result, BaseException) else result
+        for pid, result in zip(unique_ids, results)
+    }
+    return [by_id[pid] for pid in patient_ids]
+
+
+def run_pipeline_batch(patient_ids: list, max_workers: int | None = None) -> list:
+    """
+    Run the pipeline for many patients in parallel.
+    Returns results in the same order as patient_ids;
+    a patient that fails gets {"patient_id", "status": "FAILED", "error"}
+    instead of failing the whole batch.
+
+    MOCK mode has no API latency, so patients are spread
+    across worker processes. LIVE mode waits on Gemini, so
+    all patients go through run_pipeline_many on one event
+    loop, with at most max_workers (default GEMINI_CONCURRENCY)
+    extractions in flight.
+    """
+    if USE_MOCK:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(_run_pipeline_quiet, patient_ids))
+
+    slots = asyncio.Semaphore(max_workers) if max_workers else None
+    return asyncio.run(run_pipeline_many(patient_ids, slots))
+
+
 if __name__ == "__main__":
-    result = run_pipeline("patient_001")
+    result = asyncio.run(run_pipeline("patient_001"))
     print("\n--- FINAL EXTRACTED FORM ---")
     print(json.dumps(result["extracted_data"], indent=2))
\ No newline at end of file
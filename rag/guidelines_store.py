@@ -1,14 +1,18 @@
-import os
-import sys
+import functools
+import re
+from pathlib import Path
 
-PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-if PROJECT_ROOT not in sys.path:
-    sys.path.append(PROJECT_ROOT)
+# Each rule starts on a line beginning with "RULE "
+_RULE_SPLIT = re.compile(r"(?m)^(?=RULE )")
 
-import chromadb
+# Cached collection.count() — reset whenever rules are loaded
+_RULE_COUNT = None
 
 
+@functools.lru_cache(maxsize=1)
 def get_guidelines_store():
+    import chromadb
+
     client = chromadb.PersistentClient(path="./rag/guidelines_db")
     collection = client.get_or_create_collection(
         name="breast_cancer_guidelines"
@@ -17,64 +21,90 @@ def get_guidelines_store():
 
 
 def load_guidelines_into_store():
+    global _RULE_COUNT
     collection = get_guidelines_store()
 
-    if collection.count() > 0:
-        print(f"Guidelines already loaded: {collection.count()} rules")
+    # Another loader may have filled the store; refresh the cached count
+    count = collection.count()
+    if count > 0:
+        print(f"Guidelines already loaded: {count} rules")
+        _RULE_COUNT = count
         return collection
 
-    guidelines_path = "data/guidelines/breast_cancer_rules.txt"
-    with open(guidelines_path, "r") as f:
-        content = f.read()
-
-    rules = []
-    current_rule = []
+    content = Path("data/guidelines/breast_cancer_rules.txt").read_text()
+    rules = [r.strip() for r in _RULE_SPLIT.split(content) if r.strip()]
 
-    for line in content.split("\n"):
-        if line.startswith("RULE ") and current_rule:
-            rules.append("\n".join(current_rule))
-            current_rule = [line]
-        elif line.strip():
-            current_rule.append(line)
+    collection.add(
+        documents=rules,
+        ids=[f"rule_{i:03d}" for i in range(len(rules))],
+        metadatas=[
+            {"rule_number": i, "source": "breast_cancer_rules.txt"}
+            for i in range(len(rules))
+        ]
+    )
 
-    if current_rule:
-        rules.append("\n".join(current_rule))
+    print(f"Total rules loaded: {collection.count()}")
 
-    for i, rule in enumerate(rules):
-        rule_id = f"rule_{i:03d}"
-        collection.add(
-            documents=[rule],
-            ids=[rule_id],
-            metadatas=[{"rule_number": i, "source": "breast_cancer_rules.txt"}]
-        )
-        print(f"Loaded: {rule_id}")
+    _RULE_COUNT = None
+    _query_guidelines_cached.cache_clear()
 
-    print(f"Total rules loaded: {collection.count()}")
     return collection
 
 
-def query_guidelines(question: str, n_results: int = 3) -> list:
+def _rule_count(collection) -> int:
+    # Only a loaded store is cached; an empty one is re-checked each time
+    global _RULE_COUNT
+    if _RULE_COUNT:
+        return _RULE_COUNT
+    count = collection.count()
+    if count > 0:
+        _RULE_COUNT = count
+    return count
+
+
+def query_guidelines(question: str, n_results: int = 3, truncate: int | None = None) -> list:
+    rules = _query_guidelines_cached(question, n_results)
+    # Fresh dicts each call so callers can't alter the cached rows
+    if truncate:
+        return [{**r, "rule": r["rule"][:truncate]} for r in rules]
+    return [dict(r) for r in rules]
+
+
+# Same question → same rules; guidelines don't change at runtime
+@functools.lru_cache(maxsize=128)
+def _query_guidelines_cached(question: str, n_results: int) -> tuple:
+    return tuple(query_guidelines_batch([question], n_results)[0])
+
+
+def query_guidelines_batch(questions: list, n_results: int = 3, truncate: int | None = None) -> list:
+    """
+    Query guidelines for many questions in one embed + search call.
+    Returns one list of rules per question, in the same order.
+    """
+    if not questions:
+        return []
+
     collection = get_guidelines_store()
 
-    if collection.count() == 0:
+    if _rule_count(collection) == 0:
         load_guidelines_into_store()
 
     results = collection.query(
-        query_texts=[question],
-        n_results=min(n_results, collection.count())
+        query_texts=list(questions),
+        n_results=min(n_results, _rule_count(collection))
     )
 
-    rules = []
-    for doc, metadata in zip(
-        results["documents"][0],
-        results["metadatas"][0]
-    ):
-        rules.append({
-            "rule": doc,
-            "rule_number": metadata["rule_number"]
-        })
-
-    return rules
+    answers = []
+    for docs, metadatas in zip(results["documents"], results["metadatas"]):
+        rules = []
+        for doc, metadata in zip(docs, metadatas):
+            rules.append({
+                "rule": doc[:truncate] if truncate else doc,
+                "rule_number": metadata["rule_number"]
+            })
+        answers.append(rules)
+
+    return answers
 
 
 if __name__ == "__main__":